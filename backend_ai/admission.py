@@ -0,0 +1,121 @@
+"""Admission control for upload jobs.
+
+Per-type limits decide whether a file is admitted, deferred to the low-priority
+lane or rejected outright, and a shared budget caps how much memory and how many
+jobs the engine runs at once.
+"""
+import os
+import asyncio
+import contextlib
+
+MB = 1024 * 1024
+
+ADMIT = "admit"
+DEFER = "defer"
+REJECT = "reject"
+
+# Per file type: over a max_* limit the job is rejected, over a defer_* limit it
+# waits for the low-priority lane.
+LIMITS = {
+    "pdf": {"max_mb": 100, "defer_mb": 20, "max_pages": 2000, "defer_pages": 300},
+    "txt": {"max_mb": 20, "defer_mb": 5},
+    "audio": {"max_mb": 500, "defer_mb": 100, "max_minutes": 240, "defer_minutes": 90},
+}
+
+# Rough peak memory per byte of input while a job runs. PDF object trees are
+# several times the file size; audio is streamed to disk and uploaded as-is.
+MEMORY_FACTOR = {"pdf": 6, "txt": 3, "audio": 1}
+
+def file_kind(ext):
+    return ext if ext in ("pdf", "txt") else "audio"
+
+def memory_cost(ext, size_bytes, low_priority=False):
+    """Budget to reserve for a job. An unknown size assumes the biggest file the lane can still
+    run, since the re-check after download parks or rejects anything larger."""
+    kind = file_kind(ext)
+    if size_bytes is None:
+        size_bytes = LIMITS[kind]["max_mb" if low_priority else "defer_mb"] * MB
+    return size_bytes * MEMORY_FACTOR[kind]
+
+def _decide(amount, unit, max_limit, defer_limit, kind):
+    if max_limit is not None and amount > max_limit:
+        return REJECT, f"{kind.upper()} is {amount:.0f} {unit} (limit {max_limit} {unit})"
+    if defer_limit is not None and amount > defer_limit:
+        return DEFER, f"Large {kind} ({amount:.0f} {unit}), queued for the low-priority lane"
+    return ADMIT, None
+
+def check_size(ext, size_bytes):
+    """Cheap check that runs before anything is downloaded."""
+    kind = file_kind(ext)
+    limits = LIMITS[kind]
+    return _decide(size_bytes / MB, "MB", limits["max_mb"], limits["defer_mb"], kind)
+
+def check_content(ext, file_path):
+    """Checks that need the file on disk: PDF page count and audio duration."""
+    kind = file_kind(ext)
+    limits = LIMITS[kind]
+    if kind == "pdf":
+        from PyPDF2 import PdfReader
+        pages = len(PdfReader(file_path).pages)  # Reads the page tree only, not the text
+        return _decide(pages, "pages", limits["max_pages"], limits["defer_pages"], kind)
+    if kind == "audio":
+        minutes = audio_minutes(file_path)
+        if minutes is None: return ADMIT, None
+        return _decide(minutes, "minutes", limits["max_minutes"], limits["defer_minutes"], kind)
+    return ADMIT, None
+
+def audio_minutes(file_path):
+    """Audio duration via mutagen if it's installed, else None (size limits still apply)."""
+    try:
+        import mutagen
+    except ImportError:
+        return None
+    try:
+        info = mutagen.File(file_path)
+        return info.info.length / 60 if info else None
+    except Exception:
+        return None
+
+class JobBudget:
+    """Shared memory + concurrency budget across running jobs.
+
+    Low-priority jobs only start when no normal job is waiting. A job bigger than
+    the whole memory budget can still run, but only on its own.
+    """
+
+    def __init__(self, memory_mb, max_jobs):
+        self.capacity = memory_mb * MB
+        self.max_jobs = max_jobs
+        self.used = 0
+        self.running = 0
+        self.waiting = 0  # Normal-priority jobs queued for a slot
+        self.cond = asyncio.Condition()
+
+    def _fits(self, cost, low_priority):
+        if self.running >= self.max_jobs: return False
+        if low_priority and self.waiting: return False
+        return self.used + cost <= self.capacity or self.running == 0
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, cost, low_priority=False):
+        async with self.cond:
+            if not low_priority: self.waiting += 1
+            try:
+                await self.cond.wait_for(lambda: self._fits(cost, low_priority))
+            finally:
+                if not low_priority: self.waiting -= 1
+            self.used += cost
+            self.running += 1
+            self.cond.notify_all()  # Queue may be empty now; let low-priority jobs re-check
+        try:
+            yield
+        finally:
+            async with self.cond:
+                self.used -= cost
+                self.running -= 1
+                self.cond.notify_all()
+
+budget = JobBudget(
+    memory_mb=int(os.getenv("ENGINE_MEMORY_BUDGET_MB", "1024")),
+    max_jobs=int(os.getenv("ENGINE_MAX_JOBS", "3")),
+)
@@ -3,29 +3,48 @@ import time
 import asyncio
 import json
 import re
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from supabase import create_client, Client
-import google.generativeai as genai
-from PyPDF2 import PdfReader
 
 # 1. SETUP
+# Clients are created by setup() so importing this module (CLI, batch jobs) stays cheap.
 load_dotenv()
+import admission
+import profiling
+from admission import MB
+
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 GEMINI_KEY = os.getenv("GEMINI_API_KEY")
 
-if not GEMINI_KEY:
-    print("❌ ERROR: GEMINI_API_KEY is missing from .env file!")
-    exit()
+supabase = None
+genai = None
+model = None
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-genai.configure(api_key=GEMINI_KEY)
-model = genai.GenerativeModel("gemini-2.5-flash") 
+def setup(with_supabase=True):
+    """Connects to Supabase and Gemini. Raises RuntimeError if a key is missing."""
+    global supabase, genai, model
+    if not GEMINI_KEY:
+        raise RuntimeError("GEMINI_API_KEY is missing from .env file!")
 
-print("🟢 Lumen AI Engine V5 (Mind Maps + Speakers) is Ready...")
+    import google.generativeai
+    if with_supabase:
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise RuntimeError("SUPABASE_URL / SUPABASE_KEY are missing from .env file!")
+        from supabase import create_client
+        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    genai = google.generativeai
+    genai.configure(api_key=GEMINI_KEY)
+    model = genai.GenerativeModel("gemini-2.5-flash") 
 
 # --- HELPER FUNCTIONS ---
+def extract_text(file_path, ext):
+    if ext == 'txt':
+        with open(file_path, encoding="utf-8", errors="replace") as f: return f.read()
+    return extract_text_from_pdf(file_path)
+
 def extract_text_from_pdf(file_path):
+    from PyPDF2 import PdfReader
     try:
         reader = PdfReader(file_path)
         text = ""
@@ -48,32 +67,99 @@ def clean_and_parse_json(raw_text):
         except: pass
     return []
 
-# --- CORE PROCESSES ---
-async def process_new_uploads():
-    """Handles heavy file processing with Mind Map & Speaker logic."""
-    response = supabase.table('notes').select("*").eq('status', 'Processing').execute()
-    if not response.data: return
+def extract_block(full_text, tag_start, tag_end):
+    if not full_text: return None
+    try: return full_text.split(tag_start)[1].split(tag_end)[0].strip()
+    except: return None
 
-    for note in response.data:
-        print(f"📄 Processing Upload: {note['audio_path']}") 
-        temp_filename = f"temp_{note['id']}"
-        
+async def generate_with_retry(inputs, wait_seconds=20, label="Upload"):
+    """Calls Gemini, backing off on 429s. Returns '' if every attempt was rate limited."""
+    for attempt in range(3):
         try:
-            # 1. Download
-            try:
-                data = supabase.storage.from_('Lectures').download(note['audio_path'])
-            except:
-                data = supabase.storage.from_('Lectures').download(note['audio_path'])
-            
-            ext = note['audio_path'].split('.')[-1].lower()
-            temp_filename += f".{ext}"
-            with open(temp_filename, "wb") as f: f.write(data)
+            # The SDK call blocks; run it in a thread so other jobs keep moving
+            result = await asyncio.to_thread(model.generate_content, inputs)
+            return result.text
+        except Exception as e:
+            if "429" in str(e):
+                print(f"   ⏳ {label} Rate Limit. Waiting {wait_seconds}s... (Attempt {attempt+1}/3)")
+                await asyncio.sleep(wait_seconds)
+            else: raise e
+    return ""
 
-            # 2. Prepare Gemini Input
-            gemini_inputs = []
-            
-            # --- UPDATED PROMPT FOR V5 ---
-            prompt = """
+async def upload_to_gemini(file_path):
+    """Uploads audio to the Gemini file API and waits until it's usable."""
+    audio_file = await asyncio.to_thread(genai.upload_file, file_path)
+    while audio_file.state.name == "PROCESSING":
+        await asyncio.sleep(1)
+        audio_file = await asyncio.to_thread(genai.get_file, audio_file.name)
+    return audio_file
+
+def parse_generation(text):
+    """Splits the model's block-formatted output into note fields."""
+    return {
+        "transcript": extract_block(text, "TRANSCRIPT_START", "TRANSCRIPT_END") or "No transcript.",
+        "summary": extract_block(text, "SUMMARY_START", "SUMMARY_END") or "No summary.",
+        "quiz": clean_and_parse_json(extract_block(text, "QUIZ_START", "QUIZ_END")),
+        "flashcards": clean_and_parse_json(extract_block(text, "FLASHCARDS_START", "FLASHCARDS_END")),
+        "tasks": clean_and_parse_json(extract_block(text, "TASKS_START", "TASKS_END")),
+        "mind_map": clean_and_parse_json(extract_block(text, "MIND_MAP_START", "MIND_MAP_END")) or {}, # Safe fallback
+    }
+
+# --- TRANSCRIPT CHUNKS ---
+TRANSCRIPT_CHUNK_CHARS = 2000
+TRANSCRIPT_PREVIEW_CHARS = 280
+SPEAKER_RE = re.compile(r"^\s*(Speaker [A-Z0-9]+)\s*:")
+
+def chunk_transcript(transcript, max_chars=TRANSCRIPT_CHUNK_CHARS):
+    """Splits a transcript into ordered chunks on speaker turns, tracking speaker and char offsets."""
+    chunks = []
+    speaker = None
+    offset = 0
+    for line in (transcript or "").splitlines(keepends=True):
+        match = SPEAKER_RE.match(line)
+        turn_changed = bool(match) and match.group(1) != speaker
+        if match: speaker = match.group(1)
+
+        for start in range(0, len(line), max_chars):
+            piece = line[start:start + max_chars]
+            if not chunks or turn_changed or len(chunks[-1]['content']) + len(piece) > max_chars:
+                chunks.append({"chunk_index": len(chunks), "speaker": speaker, "char_start": offset, "content": ""})
+                turn_changed = False
+            chunks[-1]['content'] += piece
+            offset += len(piece)
+
+    for c in chunks: c['char_end'] = c['char_start'] + len(c['content'])
+    return chunks
+
+def save_transcript_chunks(note_id, transcript):
+    """Replaces the note's transcript_chunks rows (batched inserts)."""
+    rows = [{"note_id": note_id, **c} for c in chunk_transcript(transcript)]
+    supabase.table('transcript_chunks').delete().eq("note_id", note_id).execute()
+    for i in range(0, len(rows), 100):
+        supabase.table('transcript_chunks').insert(rows[i:i + 100]).execute()
+
+def load_transcript_context(note_id, max_chars):
+    """Fetches only the leading chunks needed for max_chars, falling back to notes.transcript for older notes."""
+    # Chunks break on every speaker turn, so their sizes vary; select by offset, not by count
+    chunks = supabase.table('transcript_chunks').select("content").eq("note_id", note_id) \
+        .lt("char_start", max_chars).order("chunk_index").execute()
+    if chunks.data:
+        return "".join(c['content'] for c in chunks.data)[:max_chars]
+
+    note = supabase.table('notes').select("transcript").eq("id", note_id).single().execute()
+    if not note.data or not note.data['transcript']: return None
+    return note.data['transcript'][:max_chars]
+
+def update_glossary(note_id):
+    """Merges the note's flashcards into the user's glossary (user-wide + the note's folder).
+
+    The merge is a single upsert in the database (merge_note_glossary), so concurrent workers
+    sharing a term can't lose each other's definitions.
+    """
+    supabase.rpc('merge_note_glossary', {'p_note_id': note_id}).execute()
+
+# --- UPDATED PROMPT FOR V5 ---
+UPLOAD_PROMPT = """
             You are an expert academic tutor. Analyze the provided content.
             
             1. TRANSCRIPT: Convert audio to text. IMPORTANT: Label speakers as "Speaker A:", "Speaker B:" if multiple voices are heard.
@@ -109,94 +195,329 @@ async def process_new_uploads():
             MIND_MAP_END
             """
 
-            if ext in ['pdf', 'txt']:
-                text_content = extract_text_from_pdf(temp_filename)
-                gemini_inputs = [prompt, text_content]
-            else:
-                audio_file = genai.upload_file(temp_filename)
-                while audio_file.state.name == "PROCESSING":
-                    await asyncio.sleep(1)
-                    audio_file = genai.get_file(audio_file.name)
-                gemini_inputs = [prompt, audio_file]
-
-            # 3. Generate (With Retry)
-            text = ""
-            for attempt in range(3):
-                try:
-                    result = model.generate_content(gemini_inputs)
-                    text = result.text
-                    break
-                except Exception as e:
-                    if "429" in str(e):
-                        print(f"   ⏳ Upload Rate Limit. Waiting 20s... (Attempt {attempt+1}/3)")
-                        await asyncio.sleep(20)
-                    else: raise e
-
-            # 4. Parse Data
-            def extract_block(tag_start, tag_end):
-                try: return text.split(tag_start)[1].split(tag_end)[0].strip()
-                except: return None
-
-            transcript = extract_block("TRANSCRIPT_START", "TRANSCRIPT_END") or "No transcript."
-            summary = extract_block("SUMMARY_START", "SUMMARY_END") or "No summary."
-
-            q_json = clean_and_parse_json(extract_block("QUIZ_START", "QUIZ_END"))
-            f_json = clean_and_parse_json(extract_block("FLASHCARDS_START", "FLASHCARDS_END"))
-            t_json = clean_and_parse_json(extract_block("TASKS_START", "TASKS_END"))
-            
-            # NEW: Mind Map Parsing
-            mm_json = clean_and_parse_json(extract_block("MIND_MAP_START", "MIND_MAP_END"))
-            if not mm_json: mm_json = {} # Safe fallback
+# --- REGENERATION PROMPTS ---
+# Each artifact can be rebuilt from notes.transcript alone (text in, text out),
+# so a regen job never touches Storage or the Gemini file API.
+ARTIFACT_PROMPTS = {
+    "quiz": (
+        "Generate 5 multiple-choice questions that test understanding of the content.",
+        "QUIZ_START", "QUIZ_END",
+        '[{"question": "...", "options": ["A", "B"], "answer": "A"}]',
+    ),
+    "flashcards": (
+        "Identify 5-10 key terms and their definitions. Avoid these existing terms: {existing}",
+        "FLASHCARDS_START", "FLASHCARDS_END",
+        '[{"front": "Term", "back": "Definition"}]',
+    ),
+    "tasks": (
+        'Extract any homework/deadlines (e.g. "Assignment due Friday").',
+        "TASKS_START", "TASKS_END",
+        '[{"title": "Task", "due_date": "2025-01-01"}]',
+    ),
+    "mind_map": (
+        "Generate a hierarchical JSON tree representing the topic structure.",
+        "MIND_MAP_START", "MIND_MAP_END",
+        '{"id": "root", "label": "Main Topic", "children": [{"id": "1", "label": "Subtopic", "children": []}]}',
+    ),
+}
+
+def build_artifact_prompt(artifact, transcript, existing=""):
+    instruction, tag_start, tag_end, example = ARTIFACT_PROMPTS[artifact]
+    return f"""
+            You are an expert academic tutor. Analyze the provided transcript.
+
+            TASK: {instruction.format(existing=existing or "none")}
+
+            Output format (Strict JSON block):
+            {tag_start}
+            {example}
+            {tag_end}
+
+            TRANSCRIPT:
+            {transcript}
+            """
+
+# --- QUEUE CLAIMS ---
+# A claim is a lease: the job renews claimed_at while it runs, and a claim older than
+# CLAIM_LEASE_SECONDS (its worker was killed or redeployed) goes back to the queue.
+CLAIM_LEASE_SECONDS = int(os.getenv("ENGINE_CLAIM_LEASE_SECONDS", "600"))
+
+def utc_now(offset_seconds=0):
+    return (datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)).isoformat()
+
+def claim(table, row_id, column, expected, value):
+    """Atomically takes a queue row for this worker.
+
+    The update only matches while `column` still holds `expected`, so when several workers
+    poll the same queue exactly one of them gets the row back.
+    """
+    query = supabase.table(table).update({column: value, "claimed_at": utc_now()}).eq("id", row_id)
+    query = query.is_(column, "null") if expected is None else query.eq(column, expected)
+    return bool(query.execute().data)
+
+def hold_claim(table, row_id):
+    """Renews a claim in the background until the returned task is cancelled."""
+    async def renew():
+        while True:
+            await asyncio.sleep(CLAIM_LEASE_SECONDS / 3)
+            try: supabase.table(table).update({"claimed_at": utc_now()}).eq("id", row_id).execute()
+            except Exception as e: print(f"   ⚠️ Could not renew claim on {table} {row_id}: {e}")
+    return asyncio.create_task(renew())
+
+def release(table, row_id, **queued):
+    """Hands a claimed row back to its queue, e.g. after a failed chat or a shutdown mid-job."""
+    supabase.table(table).update({**queued, "claimed_at": None}).eq("id", row_id).execute()
+
+async def requeue_stale_claims():
+    """Hands back rows whose lease lapsed. Notes restart at Processing; admission re-parks large ones."""
+    cutoff = utc_now(-CLAIM_LEASE_SECONDS)
+    stale = supabase.table('notes').update({"status": "Processing", "claimed_at": None}) \
+        .eq('status', 'Claimed').lt('claimed_at', cutoff).execute().data or []
+    stale += supabase.table('artifact_requests').update({"status": "Pending", "claimed_at": None}) \
+        .eq('status', 'Running').lt('claimed_at', cutoff).execute().data or []
+    stale += supabase.table('chat_messages').update({"claimed_at": None}) \
+        .is_('response', 'null').lt('claimed_at', cutoff).execute().data or []
+    if stale: print(f"   ♻️ Requeued {len(stale)} stale claims")
+
+# --- UPLOAD ADMISSION ---
+in_flight = {}       # note id -> True if it's running in the low-priority lane
+upload_tasks = set() # Keeps background upload tasks referenced until they finish
 
+def set_status(note_id, status, detail=None):
+    supabase.table('notes').update({"status": status, "status_detail": detail}).eq("id", note_id).execute()
+
+def remote_size(path):
+    """Size of a Storage object from its metadata, without downloading it (None if unknown)."""
+    folder, _, name = path.rpartition('/')
+    try: items = supabase.storage.from_('Lectures').list(folder, {"search": name}) or []
+    except Exception: return None
+    for item in items:
+        if item.get('name') == name:
+            return (item.get('metadata') or {}).get('size')
+    return None
+
+def download_to_file(path, dest):
+    """Streams a Storage object to disk in 1 MB chunks instead of holding it all in memory."""
+    import httpx
+    signed = supabase.storage.from_('Lectures').create_signed_url(path, 600)
+    url = signed.get('signedURL') or signed.get('signedUrl')
+    with httpx.stream("GET", url, timeout=120) as r:
+        r.raise_for_status()
+        with open(dest, "wb") as f:
+            for chunk in r.iter_bytes(MB): f.write(chunk)
+
+def park(note, decision, reason, low_priority):
+    """Marks the note Rejected/Deferred when admission says it can't run now. Returns True if parked."""
+    if decision == admission.ADMIT or (decision == admission.DEFER and low_priority): return False
+    print(f"   🚫 {decision.title()}: {note['audio_path']} ({reason})")
+    set_status(note['id'], "Rejected" if decision == admission.REJECT else "Deferred", reason)
+    return True
+
+def start_upload(note, low_priority=False):
+    in_flight[note['id']] = low_priority
+    task = asyncio.create_task(run_upload(note, low_priority))
+    upload_tasks.add(task)
+    task.add_done_callback(upload_tasks.discard)
+
+async def run_upload(note, low_priority):
+    """Admits one upload against the size limits and the shared budget, then processes it."""
+    profile = profiling.JobProfile(note['id'])
+    lease = hold_claim('notes', note['id'])
+    try:
+        ext = note['audio_path'].split('.')[-1].lower()
+        with profile.stage("admission"):
+            size = await asyncio.to_thread(remote_size, note['audio_path'])
+            parked = size is not None and park(note, *admission.check_size(ext, size), low_priority)
+        if parked:
+            profile.outcome = "Parked"
+            return
+
+        queued = time.perf_counter()
+        async with admission.budget.reserve(admission.memory_cost(ext, size, low_priority), low_priority):
+            profile.record("budget wait", queued)
+            profile.outcome = await process_upload(note, ext, low_priority, profile)
+    except asyncio.CancelledError:  # Engine shutting down: hand the note back instead of stranding it
+        release('notes', note['id'], status="Processing")
+        raise
+    except Exception as e:
+        print(f"   ❌ Upload Error: {e}")
+        profile.outcome = "Error"
+        set_status(note['id'], "Error")
+    finally:
+        lease.cancel()
+        in_flight.pop(note['id'], None)
+        saved = profile.finish()
+        if saved: print(f"   🔬 Profile saved: {saved}")
+
+async def process_new_uploads():
+    """Starts newly uploaded notes in the background; the job budget decides how many run at once."""
+    response = supabase.table('notes').select("*").eq('status', 'Processing').execute()
+    for note in response.data or []:
+        if note['id'] in in_flight: continue
+        if claim('notes', note['id'], 'status', 'Processing', 'Claimed'): start_upload(note)
+
+async def process_deferred_uploads():
+    """Low-priority lane: oversized uploads, one at a time, only when no normal job is waiting."""
+    if any(in_flight.values()): return
+    response = supabase.table('notes').select("*").eq('status', 'Deferred').order('created_at').limit(1).execute()
+    for note in response.data or []:
+        if note['id'] in in_flight: continue
+        if claim('notes', note['id'], 'status', 'Deferred', 'Claimed'): start_upload(note, low_priority=True)
+
+# --- CORE PROCESSES ---
+async def process_upload(note, ext, low_priority=False, profile=None):
+    """Handles heavy file processing with Mind Map & Speaker logic. Returns 'Done' or 'Parked'."""
+    profile = profile or profiling.JobProfile(note['id'])
+    print(f"📄 Processing Upload: {note['audio_path']}") 
+    temp_filename = f"temp_{note['id']}.{ext}"
+    
+    try:
+        # 1. Download (streamed to disk)
+        with profile.stage("download"):
+            try:
+                await asyncio.to_thread(download_to_file, note['audio_path'], temp_filename)
+            except:
+                await asyncio.to_thread(download_to_file, note['audio_path'], temp_filename)
+
+        # Re-check now the real size, page count and duration are known
+        with profile.stage("admission"):
+            if park(note, *admission.check_size(ext, os.path.getsize(temp_filename)), low_priority): return "Parked"
+            if park(note, *await asyncio.to_thread(admission.check_content, ext, temp_filename), low_priority): return "Parked"
+
+        # 2. Prepare Gemini Input
+        if ext in ['pdf', 'txt']:
+            with profile.stage("extraction"):
+                text_content = await asyncio.to_thread(extract_text, temp_filename, ext)
+            gemini_inputs = [UPLOAD_PROMPT, text_content]
+        else:
+            with profile.stage("model-file wait"):
+                gemini_inputs = [UPLOAD_PROMPT, await upload_to_gemini(temp_filename)]
+
+        # 3. Generate (With Retry)
+        with profile.stage("generation"):
+            text = await generate_with_retry(gemini_inputs)
+
+        # 4. Parse Data
+        with profile.stage("parse"):
+            result = parse_generation(text)
+        transcript, summary = result["transcript"], result["summary"]
+        q_json, f_json, t_json, mm_json = result["quiz"], result["flashcards"], result["tasks"], result["mind_map"]
+
+        with profile.stage("writes"):
             # Save Sub-Data
-            for c in f_json: supabase.table('flashcards').insert({'note_id': note['id'], 'front': c['front'], 'back': c['back']}).execute()
-            for t in t_json: supabase.table('study_tasks').insert({'user_id': note['user_id'], 'title': t['title'], 'due_date': t.get('due_date'), 'origin_note_id': note['id']}).execute()
+            with profile.stage("transcript chunks"):
+                save_transcript_chunks(note['id'], transcript)
+            with profile.stage("flashcards"):
+                for c in f_json: supabase.table('flashcards').insert({'note_id': note['id'], 'front': c['front'], 'back': c['back']}).execute()
+            with profile.stage("tasks"):
+                for t in t_json: supabase.table('study_tasks').insert({'user_id': note['user_id'], 'title': t['title'], 'due_date': t.get('due_date'), 'origin_note_id': note['id']}).execute()
 
             # Final Update (With Mind Map!)
-            supabase.table('notes').update({
-                "transcript": transcript, 
-                "summary": summary, 
-                "quiz": q_json, 
-                "mind_map": mm_json, # <--- The New Feature
-                "status": "Done"
-            }).eq("id", note['id']).execute()
+            with profile.stage("note"):
+                supabase.table('notes').update({
+                    "transcript": transcript, 
+                    "transcript_preview": transcript[:TRANSCRIPT_PREVIEW_CHARS],
+                    "summary": summary, 
+                    "quiz": q_json, 
+                    "mind_map": mm_json, # <--- The New Feature
+                    "status": "Done",
+                    "status_detail": None,
+                }).eq("id", note['id']).execute()
             
-            print("   ✅ Upload Processed (with Mind Map)!")
+            # Keep the searchable glossary in step with the new cards
+            with profile.stage("glossary"):
+                try: update_glossary(note['id'])
+                except Exception as e: print(f"   ⚠️ Glossary Update Error: {e}")
+
+        print("   ✅ Upload Processed (with Mind Map)!")
+        return "Done"
+    
+    finally:
+        if os.path.exists(temp_filename): os.remove(temp_filename)
+
+async def process_artifact_requests():
+    """Regenerates a single artifact (quiz, flashcards, tasks, mind_map) from the stored transcript."""
+    response = supabase.table('artifact_requests').select("*").eq('status', 'Pending').execute()
+    if not response.data: return
+
+    for job in response.data:
+        if not claim('artifact_requests', job['id'], 'status', 'Pending', 'Running'): continue
+        artifact = job['artifact']
+        print(f"🔁 Regenerating {artifact} for note {job['note_id']}")
+        lease = hold_claim('artifact_requests', job['id'])
+
+        try:
+            if artifact not in ARTIFACT_PROMPTS:
+                raise ValueError(f"Unknown artifact '{artifact}'")
 
+            # 1. Get Context (no download, no audio upload)
+            note = supabase.table('notes').select("id, user_id, transcript").eq("id", job['note_id']).single().execute()
+            transcript = (note.data or {}).get('transcript')
+            if not transcript or transcript == "No transcript.":
+                raise ValueError("Note has no stored transcript to regenerate from")
+
+            existing = ""
+            if artifact == "flashcards":
+                cards = supabase.table('flashcards').select("front").eq("note_id", job['note_id']).execute()
+                existing = ", ".join(c['front'] for c in cards.data or [])
+
+            # 2. Generate only the requested block
+            text = await generate_with_retry(build_artifact_prompt(artifact, transcript, existing), label="Regen")
+            _, tag_start, tag_end, _ = ARTIFACT_PROMPTS[artifact]
+            block = extract_block(text, tag_start, tag_end)
+            parsed = clean_and_parse_json(block)
+            # An explicit empty task list is a real answer (no deadlines mentioned), not a failure
+            no_tasks = artifact == "tasks" and block is not None and re.sub(r"```(json)?|\s", "", block) == "[]"
+            if not parsed and not no_tasks:
+                raise ValueError("Model returned no usable output")
+
+            # 3. Save (quiz / mind map replace, flashcards / tasks append)
+            note_id, user_id = note.data['id'], note.data['user_id']
+            if artifact == "quiz":
+                supabase.table('notes').update({"quiz": parsed}).eq("id", note_id).execute()
+            elif artifact == "mind_map":
+                supabase.table('notes').update({"mind_map": parsed}).eq("id", note_id).execute()
+            elif artifact == "flashcards":
+                for c in parsed: supabase.table('flashcards').insert({'note_id': note_id, 'front': c['front'], 'back': c['back']}).execute()
+                # The cards are saved; a glossary hiccup mustn't mark the job Error and invite a duplicate retry
+                try: update_glossary(note_id)
+                except Exception as e: print(f"   ⚠️ Glossary Update Error: {e}")
+            elif artifact == "tasks":
+                for t in parsed: supabase.table('study_tasks').insert({'user_id': user_id, 'title': t['title'], 'due_date': t.get('due_date'), 'origin_note_id': note_id}).execute()
+
+            supabase.table('artifact_requests').update({"status": "Done"}).eq("id", job['id']).execute()
+            print(f"   ✅ {artifact} Regenerated!")
+
+        except asyncio.CancelledError:
+            release('artifact_requests', job['id'], status="Pending")
+            raise
         except Exception as e:
-            print(f"   ❌ Upload Error: {e}")
-            supabase.table('notes').update({"status": "Error"}).eq("id", note['id']).execute()
-        
+            print(f"   ❌ Regen Error: {e}")
+            supabase.table('artifact_requests').update({"status": "Error", "error": str(e)}).eq("id", job['id']).execute()
         finally:
-            if os.path.exists(temp_filename): os.remove(temp_filename)
+            lease.cancel()
 
 async def process_chat_queue():
     """Handles chat messages."""
-    response = supabase.table('chat_messages').select("*").is_('response', 'null').execute()
+    response = supabase.table('chat_messages').select("*").is_('response', 'null').is_('claimed_at', 'null').execute()
     if not response.data: return
 
     for msg in response.data:
+        if not claim('chat_messages', msg['id'], 'claimed_at', None, utc_now()): continue
         print(f"💬 Chatting: {msg['question']}")
-        
+        lease = hold_claim('chat_messages', msg['id'])
+
         try:
-            # 1. Get Context
-            note = supabase.table('notes').select("transcript").eq("id", msg['note_id']).single().execute()
-            if not note.data: continue
+            # 1. Get Context (only the chunks that fit the prompt)
+            transcript = load_transcript_context(msg['note_id'], 15000)
+            if not transcript:  # Note still processing; retry on a later poll
+                release('chat_messages', msg['id'])
+                continue
             
-            transcript = note.data['transcript']
-            prompt = f"Context: {transcript[:15000]}\nStudent Question: {msg['question']}\n\nAnswer cleanly and concisely:"
+            prompt = f"Context: {transcript}\nStudent Question: {msg['question']}\n\nAnswer cleanly and concisely:"
 
             # 2. Generate Answer
-            answer = ""
-            for attempt in range(3):
-                try:
-                    result = model.generate_content(prompt)
-                    answer = result.text
-                    break
-                except Exception as e:
-                    if "429" in str(e):
-                        await asyncio.sleep(5)
-                    else: raise e
+            answer = await generate_with_retry(prompt, wait_seconds=5, label="Chat")
             
             if not answer: answer = "I'm having trouble connecting to the AI right now."
 
@@ -204,14 +525,34 @@ async def process_chat_queue():
             supabase.table('chat_messages').update({"response": answer}).eq("id", msg['id']).execute()
             print("   ✅ Answer Sent!")
 
+        except asyncio.CancelledError:
+            release('chat_messages', msg['id'])
+            raise
         except Exception as e:
             print(f"   ⚠️ Chat Error: {e}")
+            release('chat_messages', msg['id'])
+        finally:
+            lease.cancel()
 
 # --- MAIN LOOP ---
+# Queue name -> processor, used by run_engine.py to start role-specific workers
+WORKERS = {
+    "upload": process_new_uploads,
+    "deferred": process_deferred_uploads,
+    "chat": process_chat_queue,
+    "regen": process_artifact_requests,
+}
+
 async def main_loop():
     while True:
-        await asyncio.gather(process_new_uploads(), process_chat_queue())
+        await asyncio.gather(process_new_uploads(), process_deferred_uploads(), process_chat_queue(), process_artifact_requests(), requeue_stale_claims())
         await asyncio.sleep(1)
 
 if __name__ == "__main__":
-    asyncio.run(main_loop())
\ No newline at end of file
+    try:
+        setup()
+    except RuntimeError as e:
+        print(f"❌ ERROR: {e}")
+        exit()
+    print("🟢 Lumen AI Engine V5 (Mind Maps + Speakers) is Ready...")
+    asyncio.run(main_loop())
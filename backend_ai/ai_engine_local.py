@@ -3,26 +3,46 @@ import time
 import asyncio
 import json
 import re
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from supabase import create_client, Client
-import ollama  # <--- The Local Hero
-from PyPDF2 import PdfReader
 
 # 1. SETUP
+# Clients are created by setup() so importing this module (CLI, benchmarks) stays cheap.
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 # CONFIG: Choose your model (llama3.2 is fast, mistral is smart)
 LOCAL_MODEL = "llama3.2" 
 
-print(f"🦁 Lumen LOCAL Engine (Powered by {LOCAL_MODEL}) is Ready...")
-print("⚠️  Warning: This runs on YOUR hardware. Speed depends on your GPU/CPU.")
+# CONFIG: Model serving. Keep the model resident between jobs and let chat run
+# alongside a long summary (the Ollama server also needs OLLAMA_NUM_PARALLEL >= this).
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+PARALLELISM = int(os.getenv("OLLAMA_PARALLELISM", "2"))
+NUM_CTX = {
+    "chat": int(os.getenv("OLLAMA_CHAT_CTX", "4096")),        # 5k chars of context + question
+    "document": int(os.getenv("OLLAMA_DOCUMENT_CTX", "8192")), # 20k chars of content + output blocks
+}
+
+supabase = None
+client = None
+llm_slots = asyncio.Semaphore(PARALLELISM)
+
+def setup():
+    """Connects to Supabase and builds the pooled Ollama client. Raises RuntimeError if a key is missing."""
+    global supabase, client
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise RuntimeError("SUPABASE_URL / SUPABASE_KEY are missing from .env file!")
+    from supabase import create_client
+    import ollama  # <--- The Local Hero
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    # One pooled async client (shared HTTP connections) for every request
+    client = ollama.AsyncClient(host=os.getenv("OLLAMA_HOST"))
 
 # --- HELPER FUNCTIONS ---
 def extract_text_from_pdf(file_path):
+    from PyPDF2 import PdfReader
     try:
         reader = PdfReader(file_path)
         text = ""
@@ -56,6 +76,67 @@ def extract_block(full_text, tag_start, tag_end):
     except:
         return None
 
+# --- QUEUE CLAIMS ---
+# A claim is a lease: the job renews claimed_at while it runs, and a claim older than
+# CLAIM_LEASE_SECONDS (its worker was killed or redeployed) goes back to the queue.
+CLAIM_LEASE_SECONDS = int(os.getenv("ENGINE_CLAIM_LEASE_SECONDS", "600"))
+
+def utc_now(offset_seconds=0):
+    return (datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)).isoformat()
+
+def claim(table, row_id, column, expected, value):
+    """Atomically takes a queue row for this worker.
+
+    The update only matches while `column` still holds `expected`, so when several workers
+    poll the same queue exactly one of them gets the row back.
+    """
+    query = supabase.table(table).update({column: value, "claimed_at": utc_now()}).eq("id", row_id)
+    query = query.is_(column, "null") if expected is None else query.eq(column, expected)
+    return bool(query.execute().data)
+
+def hold_claim(table, row_id):
+    """Renews a claim in the background until the returned task is cancelled."""
+    async def renew():
+        while True:
+            await asyncio.sleep(CLAIM_LEASE_SECONDS / 3)
+            try: supabase.table(table).update({"claimed_at": utc_now()}).eq("id", row_id).execute()
+            except Exception as e: print(f"   ⚠️ Could not renew claim on {table} {row_id}: {e}")
+    return asyncio.create_task(renew())
+
+def release(table, row_id, **queued):
+    """Hands a claimed row back to its queue, e.g. after a failed chat or a shutdown mid-job."""
+    supabase.table(table).update({**queued, "claimed_at": None}).eq("id", row_id).execute()
+
+async def requeue_stale_claims():
+    """Hands back notes and chat messages whose lease lapsed."""
+    cutoff = utc_now(-CLAIM_LEASE_SECONDS)
+    stale = supabase.table('notes').update({"status": "Processing", "claimed_at": None}) \
+        .eq('status', 'Claimed').lt('claimed_at', cutoff).execute().data or []
+    stale += supabase.table('chat_messages').update({"claimed_at": None}) \
+        .is_('response', 'null').lt('claimed_at', cutoff).execute().data or []
+    if stale: print(f"   ♻️ Requeued {len(stale)} stale claims")
+
+# --- MODEL SERVING ---
+async def warm_model():
+    """Loads the model into memory up front so the first real request doesn't pay the load time."""
+    try:
+        start = time.perf_counter()
+        await client.generate(model=LOCAL_MODEL, prompt="", keep_alive=KEEP_ALIVE)
+        print(f"🔥 {LOCAL_MODEL} warmed in {time.perf_counter() - start:.1f}s (keep-alive {KEEP_ALIVE})")
+    except Exception as e:
+        print(f"   ⚠️ Warm-up failed (first request will load the model): {e}")
+
+async def local_chat(messages, kind="chat"):
+    """Runs one chat completion, bounded by PARALLELISM, with a context size tuned to the request type."""
+    async with llm_slots:
+        response = await client.chat(
+            model=LOCAL_MODEL,
+            messages=messages,
+            keep_alive=KEEP_ALIVE,
+            options={"num_ctx": NUM_CTX[kind]},
+        )
+    return response['message']['content']
+
 # --- CORE PROCESSES ---
 async def process_new_uploads():
     """Handles file processing locally."""
@@ -63,8 +144,10 @@ async def process_new_uploads():
     if not response.data: return
 
     for note in response.data:
+        if not claim('notes', note['id'], 'status', 'Processing', 'Claimed'): continue
         print(f"📄 Processing Upload Locally: {note['audio_path']}") 
         temp_filename = f"temp_{note['id']}"
+        lease = hold_claim('notes', note['id'])
         
         try:
             # 1. Download
@@ -82,7 +165,7 @@ async def process_new_uploads():
             # We assume it's a PDF/Text for now. If audio, we need Whisper (later).
             text_content = ""
             if ext in ['pdf', 'txt']:
-                text_content = extract_text_from_pdf(temp_filename)
+                text_content = await asyncio.to_thread(extract_text_from_pdf, temp_filename)
             else:
                 print("   ⚠️ Local Audio Transcribing requires Whisper (Skipping for now)")
                 text_content = "Audio transcription not supported in simple local mode yet."
@@ -125,10 +208,9 @@ async def process_new_uploads():
             print("   🧠 Local Brain is Thinking... (This might take a minute)")
             
             # --- THE LOCAL CALL ---
-            response = ollama.chat(model=LOCAL_MODEL, messages=[
+            text = await local_chat([
                 {'role': 'user', 'content': prompt},
-            ])
-            text = response['message']['content']
+            ], kind="document")
             # ----------------------
 
             # 4. Parse & Save
@@ -154,49 +236,85 @@ async def process_new_uploads():
             
             print("   ✅ Local Processing Complete!")
 
+        except asyncio.CancelledError:  # Engine shutting down: hand the note back instead of stranding it
+            release('notes', note['id'], status="Processing")
+            raise
         except Exception as e:
             print(f"   ❌ Local Error: {e}")
             supabase.table('notes').update({"status": "Error"}).eq("id", note['id']).execute()
         
         finally:
+            lease.cancel()
             if os.path.exists(temp_filename): os.remove(temp_filename)
 
 async def process_chat_queue():
     """Handles chat messages locally."""
-    response = supabase.table('chat_messages').select("*").is_('response', 'null').execute()
+    response = supabase.table('chat_messages').select("*").is_('response', 'null').is_('claimed_at', 'null').execute()
     if not response.data: return
 
-    for msg in response.data:
-        print(f"💬 Local Chat: {msg['question']}")
+    # Answer concurrently; local_chat caps how many reach the model at once
+    now = utc_now()
+    claimed = [msg for msg in response.data if claim('chat_messages', msg['id'], 'claimed_at', None, now)]
+    await asyncio.gather(*(answer_chat_message(msg) for msg in claimed))
+
+async def answer_chat_message(msg):
+    print(f"💬 Local Chat: {msg['question']}")
+    lease = hold_claim('chat_messages', msg['id'])
+    
+    try:
+        note = supabase.table('notes').select("transcript").eq("id", msg['note_id']).single().execute()
+        if not note.data or not note.data['transcript']:  # Note still processing; retry on a later poll
+            release('chat_messages', msg['id'])
+            return
         
-        try:
-            note = supabase.table('notes').select("transcript").eq("id", msg['note_id']).single().execute()
-            if not note.data: continue
-            
-            context = note.data['transcript'][:5000] # Limit context for speed
-            
-            # --- THE LOCAL CALL ---
-            response = ollama.chat(model=LOCAL_MODEL, messages=[
-                {'role': 'system', 'content': f"Context: {context}"},
-                {'role': 'user', 'content': msg['question']},
-            ])
-            answer = response['message']['content']
-            # ----------------------
+        context = note.data['transcript'][:5000] # Limit context for speed
+        
+        # --- THE LOCAL CALL ---
+        answer = await local_chat([
+            {'role': 'system', 'content': f"Context: {context}"},
+            {'role': 'user', 'content': msg['question']},
+        ], kind="chat")
+        # ----------------------
 
-            supabase.table('chat_messages').update({"response": answer}).eq("id", msg['id']).execute()
-            print("   ✅ Answer Sent!")
+        supabase.table('chat_messages').update({"response": answer}).eq("id", msg['id']).execute()
+        print("   ✅ Answer Sent!")
 
-        except Exception as e:
-            print(f"   ⚠️ Local Chat Error: {e}")
+    except asyncio.CancelledError:
+        release('chat_messages', msg['id'])
+        raise
+    except Exception as e:
+        print(f"   ⚠️ Local Chat Error: {e}")
+        release('chat_messages', msg['id'])
+    finally:
+        lease.cancel()
 
 # --- MAIN LOOP ---
-async def main_loop():
+# Queue name -> processor, used by run_engine.py to start role-specific workers
+WORKERS = {
+    "upload": process_new_uploads,
+    "chat": process_chat_queue,
+}
+
+async def poll_forever(process, interval=2):
     while True:
-        await asyncio.gather(process_new_uploads(), process_chat_queue())
-        await asyncio.sleep(2)
+        await process()
+        await asyncio.sleep(interval)
+
+async def main_loop():
+    await warm_model()
+    # Separate loops so a chat never waits for the current upload to finish
+    await asyncio.gather(poll_forever(process_new_uploads), poll_forever(process_chat_queue),
+                         poll_forever(requeue_stale_claims, interval=60))
 
 if __name__ == "__main__":
+    try:
+        setup()
+    except RuntimeError as e:
+        print(f"❌ ERROR: {e}")
+        exit()
+    print(f"🦁 Lumen LOCAL Engine (Powered by {LOCAL_MODEL}) is Ready...")
+    print("⚠️  Warning: This runs on YOUR hardware. Speed depends on your GPU/CPU.")
     try:
         asyncio.run(main_loop())
     except KeyboardInterrupt:
-        print("\n🔴 Local Engine Stopped.")
\ No newline at end of file
+        print("\n🔴 Local Engine Stopped.")
@@ -0,0 +1,150 @@
+"""Cold-start vs. warm latency for the local (Ollama) engine, against a stub Ollama server.
+
+Run:  python bench_local_engine.py [--load 2.0] [--infer 0.3] [--requests 8]
+
+The stub mimics the parts of Ollama that matter here: the first request after the
+model is unloaded pays LOAD seconds, every request pays INFER seconds, the server
+runs up to --server-parallel requests at once, and keep_alive controls how long the
+model stays resident. No real model or Supabase project is needed.
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import threading
+import statistics
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# --- STUB OLLAMA SERVER ---
+class StubOllama(BaseHTTPRequestHandler):
+    load_seconds = 2.0
+    infer_seconds = 0.3
+    loaded_until = 0.0   # monotonic time the model stays resident until
+    lock = threading.Lock()
+    slots = threading.Semaphore(4)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+        cls = type(self)
+
+        with cls.lock:
+            if time.monotonic() > cls.loaded_until:
+                time.sleep(cls.load_seconds)  # model load blocks every caller, like the real server
+            cls.loaded_until = time.monotonic() + parse_keep_alive(body.get('keep_alive'))
+
+        # An empty generate is Ollama's "just load the model" call
+        if not (self.path == "/api/generate" and not body.get('prompt')):
+            with cls.slots:
+                time.sleep(cls.infer_seconds)
+
+        reply = {"model": body.get('model'), "created_at": "2025-01-01T00:00:00Z", "done": True, "done_reason": "stop"}
+        if self.path == "/api/chat":
+            reply["message"] = {"role": "assistant", "content": "SUMMARY_START\nstub\nSUMMARY_END"}
+        else:
+            reply["response"] = ""
+        data = json.dumps(reply).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def parse_keep_alive(value):
+    """Ollama accepts seconds or '5m'/'1h' style durations; default is 5 minutes."""
+    if value is None: return 300
+    if isinstance(value, (int, float)): return value
+    units = {"s": 1, "m": 60, "h": 3600}
+    return float(value[:-1]) * units[value[-1]] if value[-1] in units else float(value)
+
+def unload_model():
+    StubOllama.loaded_until = 0.0
+
+# --- SCENARIOS ---
+def old_engine_requests(n, question):
+    """What ai_engine_local.py used to do: blocking ollama.chat, one request at a time.
+
+    Latencies here are service time only; a real queued chat also waits for the ones ahead of it.
+    """
+    import ollama
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        ollama.chat(model=engine.LOCAL_MODEL, messages=[{'role': 'user', 'content': question}])
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+async def new_engine_requests(n, question):
+    """Current engine: pooled AsyncClient, concurrent up to PARALLELISM, keep-alive pinned."""
+    async def one():
+        start = time.perf_counter()
+        await engine.local_chat([{'role': 'user', 'content': question}], kind="chat")
+        return time.perf_counter() - start
+    return await asyncio.gather(*(one() for _ in range(n)))
+
+def report(label, latencies, wall):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{label:<34} p50 {statistics.median(latencies):6.2f}s  p95 {p95:6.2f}s  wall {wall:6.2f}s")
+
+async def new_engine_scenarios(n):
+    """Both new-engine runs share one event loop, as they would in the running engine."""
+    unload_model()
+    await engine.warm_model()  # happens at engine startup, not on the user's request
+    start = time.perf_counter()
+    cold = await new_engine_requests(1, "What is osmosis?")
+    cold_wall = time.perf_counter() - start
+
+    start = time.perf_counter()
+    steady = await new_engine_requests(n, "Explain diffusion.")
+    return (cold, cold_wall), (steady, time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--load", type=float, default=2.0, help="Stub model load time (s)")
+    parser.add_argument("--infer", type=float, default=0.3, help="Stub per-request inference time (s)")
+    parser.add_argument("--requests", type=int, default=8, help="Requests per steady-state burst")
+    parser.add_argument("--server-parallel", type=int, default=4, help="Stub OLLAMA_NUM_PARALLEL")
+    args = parser.parse_args()
+
+    StubOllama.load_seconds, StubOllama.infer_seconds = args.load, args.infer
+    StubOllama.slots = threading.Semaphore(args.server_parallel)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Point the engine at the stub before it builds its clients
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("SUPABASE_URL", f"http://127.0.0.1:{server.server_port}")
+    os.environ.setdefault("SUPABASE_KEY", "bench.stub.key")
+    global engine
+    import ai_engine_local as engine
+    engine.setup()
+
+    print(f"\n📊 Stub Ollama: load {args.load}s, inference {args.infer}s, "
+          f"server parallel {args.server_parallel}, engine PARALLELISM {engine.PARALLELISM}\n")
+
+    # 1. Old engine: cold first chat, then a burst with the model resident
+    unload_model()
+    start = time.perf_counter()
+    cold_old = (old_engine_requests(1, "What is osmosis?"), time.perf_counter() - start)
+    start = time.perf_counter()
+    steady_old = (old_engine_requests(args.requests, "Explain diffusion."), time.perf_counter() - start)
+
+    # 2. New engine: warmed at startup, pooled and concurrent
+    cold_new, steady_new = asyncio.run(new_engine_scenarios(args.requests))
+
+    report("Cold, no warm-up (old)", *cold_old)
+    report("Cold, warmed at startup (new)", *cold_new)
+    report(f"Steady, {args.requests} sequential (old)", *steady_old)
+    report(f"Steady, {args.requests} pooled (new)", *steady_new)
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
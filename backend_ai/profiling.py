@@ -0,0 +1,201 @@
+"""Opt-in per-job profiling for the engine.
+
+Every upload keeps a cheap per-stage timeline (download, extraction, model-file
+wait, generation, parse, writes). It is written to disk only when the job was
+selected up front (ENGINE_PROFILE_NOTE_IDS, ENGINE_PROFILE_SAMPLE_RATE) or took
+longer than ENGINE_PROFILE_SLOW_SECONDS. Every stage records the process RSS at
+its start and end; selected jobs are also sampled in the background every
+SAMPLE_SECONDS, so their stages (and the job) carry a peak RSS as well.
+
+Settings are re-read for every job, and the JSON file named by
+ENGINE_PROFILE_CONFIG overrides the environment, so profiling can be switched on
+for a running engine without a redeploy, e.g.
+    {"note_ids": [42], "sample_rate": 0.01, "slow_seconds": 120}
+
+Output per captured job, in ENGINE_PROFILE_DIR (default ./profiles):
+    upload_<id>_<time>.folded  collapsed stacks in microseconds (flamegraph.pl, speedscope, inferno)
+    upload_<id>_<time>.json    stage timeline with RSS at start, end and peak
+
+RSS is process-wide: a peak includes whatever other jobs were doing at the
+time, so it is exact only for a job that ran alone. Compare start and end to
+see what a stage kept.
+"""
+import os
+import json
+import time
+import random
+import threading
+import contextlib
+
+MB = 1024 * 1024
+SAMPLE_SECONDS = 0.05
+
+try:
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):  # No sysconf (Windows)
+    PAGE_SIZE = None
+
+_sampled = set()       # Selected jobs currently running
+_sampled_lock = threading.Lock()
+_sampler = None        # Background thread; runs while _sampled is non-empty
+
+def load_settings():
+    """Environment defaults, overridden by the ENGINE_PROFILE_CONFIG file. Bad values turn profiling off, never the job."""
+    settings = {
+        "note_ids": os.getenv("ENGINE_PROFILE_NOTE_IDS", "").split(","),
+        "sample_rate": os.getenv("ENGINE_PROFILE_SAMPLE_RATE", "0"),
+        "slow_seconds": os.getenv("ENGINE_PROFILE_SLOW_SECONDS", "0"),  # 0 = off
+        "dir": os.getenv("ENGINE_PROFILE_DIR", "profiles"),
+    }
+    path = os.getenv("ENGINE_PROFILE_CONFIG")
+    if path and os.path.exists(path):
+        try:
+            with open(path) as f: settings.update(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"   ⚠️ Ignoring profile config {path}: {e}")
+
+    for key in ("sample_rate", "slow_seconds"):
+        try: settings[key] = float(settings[key])
+        except (TypeError, ValueError):
+            print(f"   ⚠️ Ignoring invalid profile setting {key}={settings[key]!r}")
+            settings[key] = 0.0
+    settings["note_ids"] = {str(i).strip() for i in settings["note_ids"] or [] if str(i).strip()}
+    return settings
+
+def current_rss_mb():
+    """Resident memory of this process right now, from /proc or psutil if it's installed, else None."""
+    if PAGE_SIZE:
+        try:
+            with open("/proc/self/statm") as f:
+                return round(int(f.read().split()[1]) * PAGE_SIZE / MB, 1)
+        except (OSError, ValueError, IndexError):
+            pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return round(psutil.Process().memory_info().rss / MB, 1)
+
+def _sample_forever():
+    """Feeds the current RSS to every selected job until none is left."""
+    global _sampler
+    while True:
+        rss = current_rss_mb()
+        with _sampled_lock:
+            if not _sampled:
+                _sampler = None
+                return
+            for profile in _sampled: profile._observe(rss)
+        time.sleep(SAMPLE_SECONDS)
+
+class JobProfile:
+    """Stage timeline for one job. Use `with profile.stage("name"):`, then call finish()."""
+
+    def __init__(self, job_id, kind="upload"):
+        global _sampler
+        self.settings = load_settings()
+        self.job_id = str(job_id)
+        self.kind = kind
+        self.outcome = None
+        self.selected = self.job_id in self.settings["note_ids"] or random.random() < self.settings["sample_rate"]
+        self.stages = []
+        self._stack = []
+        self._open = []  # Memory of the stages still running, updated by the sampler
+        self._started = time.perf_counter()
+        self._started_at = time.time()
+        self.rss_peak_mb = current_rss_mb()
+        if self.selected:
+            with _sampled_lock:
+                _sampled.add(self)
+                if _sampler is None:
+                    _sampler = threading.Thread(target=_sample_forever, name="profile-sampler", daemon=True)
+                    _sampler.start()
+
+    def _observe(self, rss):
+        if rss is None: return
+        self.rss_peak_mb = max(self.rss_peak_mb or 0, rss)
+        for memory in self._open: memory["rss_peak_mb"] = max(memory["rss_peak_mb"] or 0, rss)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        rss = current_rss_mb()
+        memory = {"rss_peak_mb": rss}
+        if self.selected:
+            with _sampled_lock: self._open.append(memory)
+        self._stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(";".join(self._stack), start)
+            self._stack.pop()
+            stage = self.stages[-1]
+            stage["rss_start_mb"] = rss
+            if self.selected:
+                with _sampled_lock:
+                    self._observe(stage["rss_end_mb"])
+                    # By identity: a nested stage's dict can compare equal to its parent's
+                    del self._open[next(i for i, m in enumerate(self._open) if m is memory)]
+                stage["rss_peak_mb"] = memory["rss_peak_mb"]
+
+    def record(self, path, start, end=None):
+        """Adds a stage measured by hand (e.g. time spent waiting to enter an async context)."""
+        end = end or time.perf_counter()
+        self.stages.append({
+            "stage": path,
+            "start_ms": round((start - self._started) * 1000, 1),
+            "duration_ms": round((end - start) * 1000, 1),
+            "rss_end_mb": current_rss_mb(),
+        })
+
+    def finish(self):
+        """Stops sampling and writes the profile if the job was selected or slow. Returns the .folded path or None."""
+        elapsed = time.perf_counter() - self._started
+        if self.selected:
+            with _sampled_lock: _sampled.discard(self)
+
+        slow_seconds = self.settings["slow_seconds"]
+        slow = bool(slow_seconds) and elapsed >= slow_seconds
+        if not (self.selected or slow): return None
+
+        try:
+            base = os.path.join(self.settings["dir"], f"{self.kind}_{self.job_id}_{int(self._started_at)}")
+            self.write(base, elapsed)
+        except (OSError, TypeError, ValueError) as e:  # A bad profile dir must never fail the job
+            print(f"   ⚠️ Could not write profile to {self.settings['dir']!r}: {e}")
+            return None
+        return base + ".folded"
+
+    def write(self, base, elapsed):
+        """Writes <base>.folded and <base>.json."""
+        os.makedirs(self.settings["dir"], exist_ok=True)
+        with open(base + ".folded", "w") as f:
+            f.write(self.folded(elapsed))
+        with open(base + ".json", "w") as f:
+            json.dump({
+                "job": self.job_id,
+                "kind": self.kind,
+                "outcome": self.outcome,
+                "reason": "selected" if self.selected else "slow",
+                "started_at": self._started_at,
+                "total_ms": round(elapsed * 1000, 1),
+                "rss_peak_mb": self.rss_peak_mb if self.selected else None,  # Only selected jobs are sampled
+                "stages": sorted(self.stages, key=lambda s: s["start_ms"]),
+            }, f, indent=2)
+
+    def folded(self, elapsed):
+        """Collapsed-stack lines ("root;stage;child self_time_us") for flame graph tools."""
+        root = f"{self.kind} {self.job_id}"
+        self_us = {}
+        for s in self.stages:
+            us = int(s["duration_ms"] * 1000)
+            self_us[s["stage"]] = self_us.get(s["stage"], 0) + us
+            parent = s["stage"].rpartition(";")[0]
+            self_us[parent] = self_us.get(parent, 0) - us  # "" is the root
+        self_us[""] = self_us.get("", 0) + int(elapsed * 1_000_000)
+
+        lines = []
+        for path, us in self_us.items():
+            if us <= 0: continue
+            lines.append(f"{root};{path} {us}" if path else f"{root} {us}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,81 @@
+"""Single entry point for the Lumen AI engine.
+
+Run one role per process so each queue can be scaled on its own:
+
+    python run_engine.py upload-worker               # notes with status 'Processing' (+ 'Deferred')
+    python run_engine.py deferred-worker             # only the low-priority lane for oversized uploads
+    python run_engine.py chat-worker                 # unanswered chat_messages
+    python run_engine.py regen-worker                # pending artifact_requests
+    python run_engine.py all --backend local         # everything in one process
+
+Only the chosen backend's SDK is imported, and only after the mode is parsed.
+Jobs are claimed with a lease (ENGINE_CLAIM_LEASE_SECONDS, default 600): a job left
+claimed by a killed worker goes back to its queue once the lease lapses, and
+Ctrl-C hands in-flight jobs back right away.
+"""
+import sys
+import asyncio
+import argparse
+import importlib
+
+BACKENDS = {
+    "gemini": "ai_engine",
+    "local": "ai_engine_local",
+}
+
+MODES = {
+    "upload-worker": ["upload", "deferred"],
+    "deferred-worker": ["deferred"],
+    "chat-worker": ["chat"],
+    "regen-worker": ["regen"],
+    "all": ["upload", "deferred", "chat", "regen"],
+}
+
+async def poll_forever(name, process, interval):
+    while True:
+        try:
+            await process()
+        except Exception as e:
+            print(f"   ⚠️ {name} worker error: {e}")
+        await asyncio.sleep(interval)
+
+async def run_workers(engine, workers, interval):
+    if hasattr(engine, "warm_model"):
+        await engine.warm_model()
+    pollers = [poll_forever(name, engine.WORKERS[name], interval) for name in workers]
+    # Every role hands back jobs left claimed by a worker that died; it's a few cheap updates a minute
+    pollers.append(poll_forever("requeue", engine.requeue_stale_claims, 60))
+    await asyncio.gather(*pollers)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Lumen AI engine.")
+    parser.add_argument("mode", choices=MODES.keys(), help="Which queue(s) this process works on")
+    parser.add_argument("--backend", choices=BACKENDS.keys(), default="gemini", help="Model backend (default: gemini)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between queue polls (default: 1)")
+    args = parser.parse_args(argv)
+
+    engine = importlib.import_module(BACKENDS[args.backend])
+
+    workers = [name for name in MODES[args.mode] if name in engine.WORKERS]
+    if not workers:
+        print(f"❌ ERROR: The {args.backend} backend has no {args.mode}.")
+        return 1
+    skipped = set(MODES[args.mode]) - set(workers)
+    if skipped:
+        print(f"⚠️  Skipping {', '.join(sorted(skipped))}: not supported by the {args.backend} backend.")
+
+    try:
+        engine.setup()
+    except RuntimeError as e:
+        print(f"❌ ERROR: {e}")
+        return 1
+
+    print(f"🟢 Lumen AI Engine ({args.backend}) ready: {args.mode} [{', '.join(workers)}]")
+    try:
+        asyncio.run(run_workers(engine, workers, args.interval))
+    except KeyboardInterrupt:
+        print("\n🔴 Engine Stopped.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,9 +13,13 @@ create table public.notes (
   title text,
   audio_path text, -- Path to file in Storage
   transcript text, -- Full text
+  transcript_preview text, -- First few hundred chars, for list views
   summary text,    -- Bullet points
   quiz jsonb,      -- JSON list of questions
-  status text default 'Processing', -- 'Processing', 'Done', 'Error'
+  mind_map jsonb,  -- JSON tree (root -> children)
+  status text default 'Processing', -- 'Processing', 'Deferred', 'Claimed' (a worker took it), 'Rejected', 'Done', 'Error'
+  status_detail text, -- Why a note was Deferred/Rejected (shown in the app)
+  claimed_at timestamp with time zone, -- Lease renewed by the worker processing it; stale claims are requeued
   folder_id bigint references public.folders(id), -- Links to a folder (nullable)
   user_id uuid references auth.users not null
 );
@@ -46,16 +50,155 @@ create table public.chat_messages (
   created_at timestamp with time zone default timezone('utc'::text, now()) not null,
   question text not null,
   response text, -- AI fills this in later
+  claimed_at timestamp with time zone, -- Lease held by the chat worker answering it; stale claims are requeued
   note_id bigint references public.notes(id) on delete cascade,
   user_id uuid references auth.users not null
 );
 
+-- 5b. Create ARTIFACT REQUESTS Table (Regenerate one artifact from the stored transcript)
+create table public.artifact_requests (
+  id bigint generated by default as identity primary key,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  artifact text not null check (artifact in ('quiz', 'flashcards', 'tasks', 'mind_map')),
+  status text default 'Pending', -- 'Pending', 'Running', 'Done', 'Error'
+  error text, -- Filled in by the AI engine if regeneration fails
+  claimed_at timestamp with time zone, -- Lease renewed by the worker running it; stale claims are requeued
+  note_id bigint references public.notes(id) on delete cascade,
+  user_id uuid references auth.users not null
+);
+
+-- 5c. Create GLOSSARY TERMS Table (Maintained by the AI engine, deduplicated per user and per folder)
+create table public.glossary_terms (
+  id bigint generated by default as identity primary key,
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  term text not null,      -- Display spelling (first one seen)
+  term_key text not null,  -- Normalized term used for dedupe + prefix search
+  definition text not null, -- Primary definition (first one seen)
+  definitions jsonb default '[]'::jsonb, -- Every distinct definition merged across notes
+  note_ids bigint[] default '{}', -- Notes the term came from (pruned when a note is deleted)
+  folder_id bigint references public.folders(id) on delete cascade, -- null = user-wide glossary
+  user_id uuid references auth.users not null,
+  search tsvector generated always as (to_tsvector('simple', term || ' ' || definition)) stored,
+  constraint glossary_terms_scope_key unique nulls not distinct (user_id, folder_id, term_key)
+);
+
+create index glossary_terms_prefix on public.glossary_terms (user_id, folder_id, term_key text_pattern_ops);
+create index glossary_terms_search on public.glossary_terms using gin (search);
+
+-- Folds case, spacing, trailing punctuation and leading articles so 'The Cell.' and 'cell' merge.
+create or replace function public.glossary_term_key(term text)
+returns text
+language sql immutable
+as $$
+  select regexp_replace(trim(both ' .,:;' from lower(regexp_replace(coalesce(term, ''), '\s+', ' ', 'g'))), '^(the|a|an) ', '');
+$$;
+
+-- Merges all of a note's flashcards into its user's glossary (user-wide + the note's folder) in one
+-- atomic upsert. Safe to call again for the same note, and safe to run from several workers at once.
+create or replace function public.merge_note_glossary(p_note_id bigint)
+returns void
+language sql
+as $$
+  insert into public.glossary_terms as g (user_id, folder_id, term, term_key, definition, definitions, note_ids)
+  select n.user_id, scope.folder_id,
+         (array_agg(trim(f.front) order by f.id))[1],
+         public.glossary_term_key(f.front),
+         (array_agg(trim(f.back) order by f.id))[1],
+         jsonb_agg(distinct trim(f.back)),
+         array[n.id]
+  from public.notes n
+  join public.flashcards f on f.note_id = n.id
+  cross join lateral (select null::bigint union select n.folder_id) as scope(folder_id)
+  where n.id = p_note_id
+    and public.glossary_term_key(f.front) <> ''
+    and trim(f.back) <> ''
+  group by n.user_id, n.id, scope.folder_id, public.glossary_term_key(f.front)
+  on conflict (user_id, folder_id, term_key) do update set
+    definitions = (select jsonb_agg(distinct d) from jsonb_array_elements(g.definitions || excluded.definitions) d),
+    note_ids = (select array_agg(distinct x order by x) from unnest(g.note_ids || excluded.note_ids) x),
+    updated_at = timezone('utc'::text, now());
+$$;
+
+-- When a note is deleted (its flashcards cascade away), drop it from the glossary: remove its id,
+-- rebuild definitions from the remaining notes' cards, and delete terms no note backs any more.
+create or replace function public.prune_note_glossary()
+returns trigger
+language plpgsql
+as $$
+declare
+  affected bigint[];
+begin
+  with pruned as (
+    update public.glossary_terms
+       set note_ids = array_remove(note_ids, old.id), updated_at = timezone('utc'::text, now())
+     where user_id = old.user_id and old.id = any(note_ids)
+    returning id
+  )
+  select array_agg(id) into affected from pruned;
+
+  delete from public.glossary_terms where id = any(affected) and cardinality(note_ids) = 0;
+
+  update public.glossary_terms g
+     set definitions = coalesce((
+           select jsonb_agg(distinct trim(f.back)) from public.flashcards f
+            where f.note_id = any(g.note_ids) and public.glossary_term_key(f.front) = g.term_key
+         ), g.definitions)
+   where g.id = any(affected);
+
+  update public.glossary_terms g
+     set definition = g.definitions->>0
+   where g.id = any(affected) and not (g.definitions ? g.definition) and jsonb_array_length(g.definitions) > 0;
+
+  return old;
+end;
+$$;
+
+create trigger notes_prune_glossary
+after delete on public.notes
+for each row execute function public.prune_note_glossary();
+
+-- Backfill: build the glossary from flashcards that existed before glossary_terms (run once, safe to re-run).
+select public.merge_note_glossary(n.id)
+from public.notes n
+where exists (select 1 from public.flashcards f where f.note_id = n.id);
+
+-- Paged glossary search for the app: prefix matches on the term first, then full-text hits.
+create or replace function public.search_glossary(query text default '', folder bigint default null, page_size int default 50, page int default 0)
+returns setof public.glossary_terms
+language sql stable
+as $$
+  with q as (
+    select lower(trim(coalesce(query, ''))) as raw,
+           -- Normalized like the stored keys, so "The Cell" and "cell." both prefix-match "cell"
+           replace(replace(replace(public.glossary_term_key(query), '\', '\\'), '%', '\%'), '_', '\_') || '%' as prefix
+  )
+  select g.* from public.glossary_terms g, q
+  where g.user_id = auth.uid()
+    -- Not "is not distinct from": that can't use the (user_id, folder_id, term_key) index
+    and (folder is null and g.folder_id is null or g.folder_id = folder)
+    and (q.raw = '' or g.term_key like q.prefix or g.search @@ plainto_tsquery('simple', q.raw))
+  order by (g.term_key like q.prefix) desc, g.term_key
+  limit page_size offset page * page_size;
+$$;
+
+-- 5d. Create TRANSCRIPT CHUNKS Table (Ordered slices of notes.transcript for paged reads)
+create table public.transcript_chunks (
+  note_id bigint references public.notes(id) on delete cascade,
+  chunk_index int not null, -- 0-based order within the transcript
+  speaker text,             -- "Speaker A", ... (null if unlabeled)
+  char_start int not null,  -- Offset into notes.transcript
+  char_end int not null,
+  content text not null,
+  primary key (note_id, chunk_index)
+);
+
 -- 6. ENABLE REALTIME (So the app updates instantly)
 alter publication supabase_realtime add table folders;
 alter publication supabase_realtime add table notes;
 alter publication supabase_realtime add table study_tasks;
 alter publication supabase_realtime add table flashcards;
 alter publication supabase_realtime add table chat_messages;
+alter publication supabase_realtime add table artifact_requests;
 
 -- 7. ENABLE STORAGE (If you haven't already created the bucket)
 -- You usually do this in the Storage UI, but this creates the bucket if missing.
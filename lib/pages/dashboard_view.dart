@@ -407,6 +407,16 @@ class _DashboardViewState extends State<DashboardView> {
 
   Widget _buildLectureCard(Map<String, dynamic> note) {
     final isDone = note['status'] == 'Done';
+    final isRejected = note['status'] == 'Rejected' || note['status'] == 'Error';
+    final statusText = switch (note['status']) {
+      'Done' => "Ready",
+      'Deferred' => "Queued (large file)",
+      'Rejected' => note['status_detail'] ?? "Rejected",
+      'Error' => "Failed",
+      _ => "Processing...",
+    };
+    final badgeColor = isDone ? Colors.green : (isRejected ? Colors.red : Colors.orange);
+    final badgeText = isDone ? "DONE" : (isRejected ? "FAIL" : (note['status'] == 'Deferred' ? "LATER" : "WAIT"));
     final gradients = [
       [Colors.purpleAccent, Colors.deepPurple],
       [Colors.orangeAccent, Colors.redAccent],
@@ -451,7 +461,7 @@ class _DashboardViewState extends State<DashboardView> {
                     children: [
                       Icon(Icons.schedule, color: Colors.white.withOpacity(0.5), size: 14),
                       const SizedBox(width: 4),
-                      Text(isDone ? "Ready" : "Processing...", style: TextStyle(color: Colors.white.withOpacity(0.5), fontSize: 12)),
+                      Flexible(child: Text(statusText, style: TextStyle(color: Colors.white.withOpacity(0.5), fontSize: 12), maxLines: 1, overflow: TextOverflow.ellipsis)),
                     ],
                   )
                 ],
@@ -463,13 +473,13 @@ class _DashboardViewState extends State<DashboardView> {
                 Container(
                   padding: const EdgeInsets.symmetric(horizontal: 8, vertical: 4),
                   decoration: BoxDecoration(
-                    color: isDone ? Colors.green.withOpacity(0.2) : Colors.orange.withOpacity(0.2),
+                    color: badgeColor.withOpacity(0.2),
                     borderRadius: BorderRadius.circular(8),
-                    border: Border.all(color: isDone ? Colors.green.withOpacity(0.3) : Colors.orange.withOpacity(0.3)),
+                    border: Border.all(color: badgeColor.withOpacity(0.3)),
                   ),
                   child: Text(
-                    isDone ? "DONE" : "WAIT",
-                    style: TextStyle(color: isDone ? Colors.greenAccent : Colors.orangeAccent, fontSize: 10, fontWeight: FontWeight.bold)
+                    badgeText,
+                    style: TextStyle(color: isDone ? Colors.greenAccent : (isRejected ? Colors.redAccent : Colors.orangeAccent), fontSize: 10, fontWeight: FontWeight.bold)
                   ),
                 ),
                 const SizedBox(height: 8),
@@ -1,3 +1,4 @@
+import 'dart:async';
 import 'dart:ui';
 import 'package:flutter/material.dart';
 import 'package:supabase_flutter/supabase_flutter.dart';
@@ -11,13 +12,73 @@ class GlossaryView extends StatefulWidget {
 }
 
 class _GlossaryViewState extends State<GlossaryView> {
+  static const int _pageSize = 50;
+
   String _searchQuery = "";
+  final List<Map<String, dynamic>> _terms = [];
+  final ScrollController _scrollController = ScrollController();
+  Timer? _debounce;
+  int _page = 0;
+  bool _hasMore = true;
+  bool _loading = false;
+
+  @override
+  void initState() {
+    super.initState();
+    _scrollController.addListener(() {
+      if (_scrollController.position.extentAfter < 400) _fetchPage();
+    });
+    _fetchPage();
+  }
+
+  @override
+  void dispose() {
+    _debounce?.cancel();
+    _scrollController.dispose();
+    super.dispose();
+  }
+
+  // Server-side glossary search: only the matching page comes over the wire
+  Future<void> _fetchPage({bool reset = false}) async {
+    if (reset) {
+      _page = 0;
+      _hasMore = true;
+      _terms.clear();
+    }
+    if (_loading || !_hasMore) return;
+    setState(() => _loading = true);
+
+    final query = _searchQuery;
+    dynamic rows;
+    try {
+      rows = await Supabase.instance.client.rpc('search_glossary', params: {
+        'query': query,
+        'page_size': _pageSize,
+        'page': _page,
+      });
+    } catch (e) {
+      if (mounted) setState(() => _loading = false);
+      return;
+    }
+    if (!mounted || query != _searchQuery) return;
 
-  // Fetch all flashcards, ordered alphabetically by the term ('front')
-  final _glossaryStream = Supabase.instance.client
-      .from('flashcards')
-      .stream(primaryKey: ['id'])
-      .order('front', ascending: true);
+    final page = List<Map<String, dynamic>>.from(rows as List);
+    setState(() {
+      _terms.addAll(page);
+      _page++;
+      _hasMore = page.length == _pageSize;
+      _loading = false;
+    });
+  }
+
+  void _onSearchChanged(String val) {
+    _debounce?.cancel();
+    _debounce = Timer(const Duration(milliseconds: 300), () {
+      _searchQuery = val.trim().toLowerCase();
+      _loading = false;
+      _fetchPage(reset: true);
+    });
+  }
 
   @override
   Widget build(BuildContext context) {
@@ -55,7 +116,7 @@ class _GlossaryViewState extends State<GlossaryView> {
                   ),
                   child: TextField(
                     style: const TextStyle(color: Colors.white),
-                    onChanged: (val) => setState(() => _searchQuery = val.toLowerCase()),
+                    onChanged: _onSearchChanged,
                     decoration: InputDecoration(
                       icon: Icon(Icons.search, color: Colors.white.withOpacity(0.5)),
                       hintText: "Search your knowledge base...",
@@ -68,20 +129,13 @@ class _GlossaryViewState extends State<GlossaryView> {
 
               // 2. The List
               Expanded(
-                child: StreamBuilder<List<Map<String, dynamic>>>(
-                  stream: _glossaryStream,
-                  builder: (context, snapshot) {
-                    if (!snapshot.hasData) {
+                child: Builder(
+                  builder: (context) {
+                    if (_terms.isEmpty && _loading) {
                       return const Center(child: CircularProgressIndicator(color: AppTheme.primaryBlue));
                     }
 
-                    final allCards = snapshot.data!;
-                    
-                    // Filter locally based on search
-                    final filteredCards = allCards.where((card) {
-                      final term = (card['front'] ?? "").toString().toLowerCase();
-                      return term.contains(_searchQuery);
-                    }).toList();
+                    final filteredCards = _terms;
 
                     if (filteredCards.isEmpty) {
                       return Center(
@@ -90,12 +144,13 @@ class _GlossaryViewState extends State<GlossaryView> {
                     }
 
                     return ListView.builder(
+                      controller: _scrollController,
                       padding: const EdgeInsets.fromLTRB(16, 0, 16, 40),
                       itemCount: filteredCards.length,
                       itemBuilder: (context, index) {
                         final card = filteredCards[index];
-                        final term = card['front'] ?? "Unknown";
-                        final def = card['back'] ?? "No definition";
+                        final term = card['term'] ?? "Unknown";
+                        final def = card['definition'] ?? "No definition";
                         
                         // Logic to show Header (A, B, C...)
                         final firstLetter = term.isNotEmpty ? term[0].toUpperCase() : "#";
@@ -103,7 +158,7 @@ class _GlossaryViewState extends State<GlossaryView> {
                         if (index == 0) {
                           showHeader = true;
                         } else {
-                          final prevTerm = filteredCards[index - 1]['front'] ?? "";
+                          final prevTerm = filteredCards[index - 1]['term'] ?? "";
                           if (prevTerm.isNotEmpty && prevTerm[0].toUpperCase() != firstLetter) {
                             showHeader = true;
                           }